@@ -1,41 +1,97 @@
+from bisect import bisect_left, bisect_right
+from functools import lru_cache, reduce
+from itertools import accumulate
 from pathlib import Path
 import json
-from typing import Dict, List, Tuple, Iterable
+import mmap
+import re
+import struct
+from typing import Dict, List, Optional, Sequence, Tuple
 
+try:  # parser JSON opcional (más rápido); sin él se usa el módulo json
+    import orjson
+except ImportError:
+    orjson = None
 
-# ==== Decodificación Variable-Byte y utilidades ====
 
+# ==== Decodificación Variable-Byte y utilidades ====
 
-def _vb_decode_stream(data: bytes) -> List[int]:
-    """Decodifica una secuencia de enteros codificados con VB."""
+# Registro de postings_offsets.bin: offset (uint64) y longitud (uint32)
+_OFFSET_RECORD = struct.Struct("<QI")
+
+# Tabla para bytes.translate que limpia el bit de continuación (MSB)
+_VB_PAYLOAD = bytes(b & 0x7F for b in range(256))
+
+# Bytes finales de un entero VB (MSB=1); al eliminarlos con bytes.translate
+# quedan sólo los bytes de continuación.
+_VB_FINALES = bytes(range(0x80, 0x100))
+
+# Corridas de bytes de continuación (MSB=0). Cada corrida, junto con el byte
+# final que la sigue, es un entero VB de más de un byte.
+_VB_CONTINUACION = re.compile(rb"[\x00-\x7f]+")
+
+
+def _vb_decode_gaps_por_tramos(data: bytes) -> List[int]:
+    """Decodifica gaps VB cuando los enteros multi-byte son escasos.
+
+    Los tramos de enteros de un byte entre corridas de continuación se
+    decodifican en bloque con bytes.translate; sólo los enteros multi-byte
+    se arman en Python.
+    """
+    gaps: List[int] = []
+    pos = 0
+    for m in _VB_CONTINUACION.finditer(data):
+        ini, fin = m.span()
+        gaps.extend(data[pos:ini].translate(_VB_PAYLOAD))
+        if fin == len(data):
+            break  # VB truncado: se ignora el último entero incompleto
+        n = data[ini]
+        for b in data[ini + 1 : fin]:
+            n = (n << 7) | b
+        gaps.append((n << 7) | (data[fin] & 0x7F))
+        pos = fin + 1
+    else:
+        gaps.extend(data[pos:].translate(_VB_PAYLOAD))
+    return gaps
+
+
+def _vb_decode_dgaps(data: bytes) -> List[int]:
+    """Decodifica una secuencia VB de d-gaps y devuelve los docIDs absolutos.
+
+    La estrategia se elige según la cantidad de bytes de continuación, que se
+    cuenta en C eliminando los bytes finales:
+    - ninguno: todos los gaps son de un byte; se decodifican en bloque y la
+      suma prefija se hace en C (itertools.accumulate);
+    - pocos: se decodifica por tramos (`_vb_decode_gaps_por_tramos`) y se
+      acumula en C;
+    - muchos: recorrido byte a byte acumulando la suma prefija en la misma
+      pasada, sin materializar la lista de gaps.
+    """
+    continuacion = len(data.translate(None, _VB_FINALES))
+    if continuacion == 0:
+        # Todos los gaps ocupan un solo byte (< 128)
+        return list(accumulate(data.translate(_VB_PAYLOAD)))
+    if continuacion * 32 <= len(data):
+        return list(accumulate(_vb_decode_gaps_por_tramos(data)))
     nums: List[int] = []
+    append = nums.append
     n = 0
+    acc = 0
     for b in data:
         if b & 0x80:  # byte final
-            n = (n << 7) | (b & 0x7F)
-            nums.append(n)
+            acc += (n << 7) | (b & 0x7F)
+            append(acc)
             n = 0
         else:
             n = (n << 7) | b
-    if n != 0:
-        pass
     return nums
 
 
-def _from_dgaps(gaps: Iterable[int]) -> List[int]:
-    out: List[int] = []
-    acc = 0
-    for g in gaps:
-        acc += g
-        out.append(acc)
-    return out
-
-
 class CompressedReader:
-    def __init__(self, base_dir: Path):
+    def __init__(self, base_dir: Path, cache_size: int = 4096):
         self.idx_dir = base_dir / "index"
         self.postings_path = self.idx_dir / "postings.bin"
-        self.offsets_path = self.idx_dir / "postings_offsets.json"
+        self.offsets_path = self.idx_dir / "postings_offsets.bin"
         self.maps_path = self.idx_dir / "doc_maps.json"
         self.lexicon_path = self.idx_dir / "lexicon.bin"
 
@@ -43,31 +99,88 @@ class CompressedReader:
             self.postings_path.exists()
             and self.offsets_path.exists()
             and self.maps_path.exists()
+            and self.lexicon_path.exists()
         )
         if not have_all:
             raise FileNotFoundError(
                 "Índice comprimido incompleto: faltan archivos en index/"
             )
 
-        self._postings_blob = self.postings_path.read_bytes()
-        with open(self.offsets_path, "r", encoding="utf-8") as f:
-            raw = json.load(f)
-            self.offsets: Dict[str, Tuple[int, int]] = {
-                k: (int(v[0]), int(v[1])) for k, v in raw.items()
-            }
-        with open(self.maps_path, "r", encoding="utf-8") as f:
-            maps = json.load(f)
-            self.rev_doc_id_map: List[str] = maps.get("rev_doc_id_map", [])
-            self.doc_id_map: Dict[str, int] = maps.get("doc_id_map", {})
-            self.terms_order: List[str] = maps.get("terms_order", [])
-            self.block_size: int = int(maps.get("block_size", 8))
-
-        if not self.terms_order and self.lexicon_path.exists():
-            # Reconstruir terms_order desde lexicon.bin (front coding)
-            self.terms_order = self._decode_lexicon_fc(
-                self.lexicon_path.read_bytes(), self.block_size
+        maps = self._cargar_json(self.maps_path)
+        if "lexicon_block_offsets" not in maps:
+            # Índice de un formato anterior (p. ej. LCP en caracteres): no
+            # se puede leer con este lector, hay que reconstruirlo.
+            raise FileNotFoundError(
+                "Índice comprimido en formato anterior: falta "
+                "lexicon_block_offsets en doc_maps.json"
             )
 
+        self._postings_blob = self._mapear(self.postings_path)
+        self._offsets_blob = self._mapear(self.offsets_path)
+        self.rev_doc_id_map: List[str] = maps.get("rev_doc_id_map", [])
+        self.doc_id_map: Dict[str, int] = maps.get("doc_id_map", {})
+        self.block_size: int = int(maps.get("block_size", 8))
+
+        # El diccionario se resuelve contra lexicon.bin (front coding), sin
+        # cargar todos los términos: en memoria sólo quedan los términos base
+        # de cada bloque y, en cada búsqueda, se decodifica el bloque
+        # candidato. El term-id resultante indexa la tabla de offsets.
+        self._lexicon_blob = self._mapear(self.lexicon_path)
+        block_offsets = maps["lexicon_block_offsets"]
+        self._lexicon_block_offsets: List[int] = block_offsets
+        self._lexicon_bases: List[str] = [
+            self._decode_lexicon_base(self._lexicon_blob, pos)
+            for pos in block_offsets
+        ]
+
+        # Caches LRU por instancia: en una sesión interactiva los mismos
+        # términos se repiten entre consultas. La de offsets evita volver a
+        # decodificar el bloque del lexicón al planificar un AND
+        # (postings_size) o al decodificar postings.
+        self._offset_cache = lru_cache(maxsize=cache_size)(self._buscar_offset)
+        self._postings_cache = lru_cache(maxsize=cache_size)(
+            self._decodificar_postings
+        )
+
+    def close(self) -> None:
+        """Libera los mapas de memoria de postings, offsets y lexicón.
+
+        Después de cerrar, el lector ya no puede usarse. Mientras un archivo
+        siga mapeado no puede borrarse en Windows ni reescribirse sin riesgo.
+        """
+        self._offset_cache.cache_clear()
+        self._postings_cache.cache_clear()
+        for blob in (self._postings_blob, self._offsets_blob, self._lexicon_blob):
+            if isinstance(blob, mmap.mmap):
+                blob.close()
+
+    def __enter__(self) -> "CompressedReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @staticmethod
+    def _cargar_json(path: Path):
+        """Lee un archivo JSON de metadatos, con orjson si está instalado."""
+        data = path.read_bytes()
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+
+    @staticmethod
+    def _mapear(path: Path):
+        """Mapea un archivo binario en memoria en modo solo lectura.
+
+        Los slices del mapa devuelven bytes sin copiar el archivo completo:
+        el sistema operativo carga las páginas a medida que se acceden.
+        """
+        with open(path, "rb") as f:
+            if path.stat().st_size == 0:
+                # mmap no admite archivos vacíos
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
     @staticmethod
     def _vb_decode_number_from(data: bytes, pos: int) -> Tuple[int, int]:
         """Decodifica un número VB desde data[pos:].
@@ -86,42 +199,86 @@ class CompressedReader:
         raise ValueError("VB mal formado: fin de datos")
 
     @classmethod
-    def _decode_lexicon_fc(cls, blob: bytes, _block_size: int) -> List[str]:
-        """Decodifica el lexicón front-coded por bloques.
+    def _decode_lexicon_base(cls, blob: bytes, pos: int) -> str:
+        """Decodifica sólo el término base del bloque que empieza en pos."""
+        base_len, pos = cls._vb_decode_number_from(blob, pos)
+        return blob[pos : pos + base_len].decode("utf-8")
 
-        Retorna la lista de términos. Formato por bloque:
+    @classmethod
+    def _decode_lexicon_block(cls, blob: bytes, pos: int) -> List[str]:
+        """Decodifica un bloque del lexicón front-coded.
+
+        Retorna los términos del bloque. Formato por bloque:
         - VB(len(base)), base
         - VB(k) donde k = cantidad de followers en el bloque
         - Por cada follower: VB(lcp), VB(len_suf), sufijo
+
+        El LCP está expresado en bytes UTF-8 de la base.
         """
-        terms: List[str] = []
-        pos = 0
-        n = len(blob)
-        while pos < n:
-            # Base term
-            base_len, pos = cls._vb_decode_number_from(blob, pos)
-            base = blob[pos : pos + base_len].decode("utf-8")
-            pos += base_len
-            terms.append(base)
-
-            # Followers
-            followers, pos = cls._vb_decode_number_from(blob, pos)
-            for _ in range(followers):
-                lcp_len, pos = cls._vb_decode_number_from(blob, pos)
-                suf_len, pos = cls._vb_decode_number_from(blob, pos)
-                suf = blob[pos : pos + suf_len].decode("utf-8")
-                pos += suf_len
-                terms.append(base[:lcp_len] + suf)
+        base_len, pos = cls._vb_decode_number_from(blob, pos)
+        base_b = blob[pos : pos + base_len]
+        pos += base_len
+        terms = [base_b.decode("utf-8")]
+
+        followers, pos = cls._vb_decode_number_from(blob, pos)
+        for _ in range(followers):
+            lcp_len, pos = cls._vb_decode_number_from(blob, pos)
+            suf_len, pos = cls._vb_decode_number_from(blob, pos)
+            suf_b = blob[pos : pos + suf_len]
+            pos += suf_len
+            terms.append((base_b[:lcp_len] + suf_b).decode("utf-8"))
         return terms
 
-    def postings(self, term: str) -> List[int]:
-        off = self.offsets.get(term)
+    def _term_id(self, term: str) -> Optional[int]:
+        """Posición del término en el diccionario ordenado (term-id).
+
+        Se busca el bloque por su término base y se decodifica sólo ese
+        bloque.
+        """
+        b = bisect_right(self._lexicon_bases, term) - 1
+        if b < 0:
+            return None
+        block = self._decode_lexicon_block(
+            self._lexicon_blob, self._lexicon_block_offsets[b]
+        )
+        j = bisect_left(block, term)
+        if j == len(block) or block[j] != term:
+            return None
+        return b * self.block_size + j
+
+    def _offset(self, term: str) -> Optional[Tuple[int, int]]:
+        """(offset, longitud) de un término, vía la cache LRU."""
+        return self._offset_cache(term)
+
+    def _buscar_offset(self, term: str) -> Optional[Tuple[int, int]]:
+        """Busca (offset, longitud) de un término en la tabla binaria."""
+        i = self._term_id(term)
+        if i is None:
+            return None
+        return _OFFSET_RECORD.unpack_from(
+            self._offsets_blob, i * _OFFSET_RECORD.size
+        )
+
+    def _decodificar_postings(self, term: str) -> Tuple[int, ...]:
+        off = self._offset(term)
         if not off:
-            return []
+            return ()
         start, length = off
-        slice_bytes = self._postings_blob[start : start + length]
-        gaps = _vb_decode_stream(slice_bytes)
-        return _from_dgaps(gaps)
+        # Tupla inmutable: el mismo objeto se comparte desde la cache
+        return tuple(_vb_decode_dgaps(self._postings_blob[start : start + length]))
+
+    def postings_size(self, term: str) -> int:
+        """Tamaño en bytes de las postings comprimidas de un término.
+
+        Se lee de la tabla de offsets sin decodificar nada; sirve como
+        estimación barata de la longitud de la lista.
+        """
+        off = self._offset(term)
+        return off[1] if off else 0
+
+    def postings(self, term: str) -> Tuple[int, ...]:
+        """Postings (docIDs ordenados) de un término, vía la cache LRU."""
+        return self._postings_cache(term)
 
     def get_doc_name(self, doc_id: int) -> str:
         """Convierte un doc_id (int) a su nombre original."""
@@ -162,18 +319,18 @@ def obtener_consulta_booleana():
     ).strip()
 
 
-def _tokenizar_booleana(consulta: str):
-    import re
+# Tokens de una consulta booleana: paréntesis, operadores y palabras
+_BOOL_RE = re.compile(r"\(|\)|\bAND\b|\bOR\b|\bNOT\b|\w+", re.IGNORECASE)
+_OPERADORES = frozenset(("AND", "OR", "NOT"))
+
 
-    patron = r"\(|\)|\bAND\b|\bOR\b|\bNOT\b|\w+"
+def _tokenizar_booleana(consulta: str):
     tokens = []
-    for m in re.finditer(patron, consulta, flags=re.IGNORECASE):
+    for m in _BOOL_RE.finditer(consulta):
         tok = m.group(0)
         up = tok.upper()
-        if up in {"AND", "OR", "NOT"}:
+        if up in _OPERADORES:
             tokens.append(up)
-        elif tok in ("(", ")"):
-            tokens.append(tok)
         else:
             tokens.append(tok)
     return tokens
@@ -186,7 +343,7 @@ def _a_rpn(tokens):
     ops = []
 
     def es_operador(t):
-        return t in ("AND", "OR", "NOT")
+        return t in _OPERADORES
 
     for t in tokens:
         if t == "(":
@@ -226,65 +383,398 @@ def _a_rpn(tokens):
     return salida
 
 
-def _universo_docs_from_backend(buscar_fn) -> set:
-    u = set()
-    terms = []
-    if hasattr(buscar_fn, "__self__") and hasattr(buscar_fn.__self__, "terms_order"):
-        terms = buscar_fn.__self__.terms_order  # type: ignore[attr-defined]
-    for t in terms:
-        u.update(buscar_fn(t))
-    return u
+# ==== Operaciones booleanas sobre postings ordenadas ====
+#
+# Las postings decodificadas ya vienen ordenadas por docID y sin repetidos,
+# así que los operadores recorren ambas listas en paralelo (merge lineal) y
+# devuelven listas ordenadas, sin construir sets de docIDs.
+
+
+# Si la lista larga supera en este factor a la corta, _and busca cada docID
+# de la corta en la larga con bisect en lugar de recorrer la larga completa.
+_AND_BISECT_RATIO = 32
+
+
+def _and(a: Sequence[int], b: Sequence[int]) -> List[int]:
+    """Intersección de dos listas ordenadas de docIDs."""
+    if len(a) > len(b):
+        a, b = b, a
+    if not a:
+        return []
+    if len(b) > _AND_BISECT_RATIO * len(a):
+        return _and_bisect(a, b)
+    out: List[int] = []
+    i = j = 0
+    na, nb = len(a), len(b)
+    while i < na and j < nb:
+        x = a[i]
+        y = b[j]
+        if x == y:
+            out.append(x)
+            i += 1
+            j += 1
+        elif x < y:
+            i += 1
+        else:
+            j += 1
+    return out
+
 
+def _and_bisect(corta: Sequence[int], larga: Sequence[int]) -> List[int]:
+    """Intersección para listas de tamaños muy dispares.
+
+    Cada docID de la lista corta se busca en la larga con bisect, empezando
+    desde la posición de la búsqueda anterior: el costo es
+    O(|corta| log |larga|) y nunca se recorre la lista larga completa.
+    """
+    out: List[int] = []
+    lo = 0
+    n = len(larga)
+    for d in corta:
+        lo = bisect_left(larga, d, lo)
+        if lo == n:
+            break
+        if larga[lo] == d:
+            out.append(d)
+            lo += 1
+    return out
+
+
+def _or(a: Sequence[int], b: Sequence[int]) -> List[int]:
+    """Unión de dos listas ordenadas de docIDs."""
+    out: List[int] = []
+    i = j = 0
+    na, nb = len(a), len(b)
+    while i < na and j < nb:
+        x = a[i]
+        y = b[j]
+        if x == y:
+            out.append(x)
+            i += 1
+            j += 1
+        elif x < y:
+            out.append(x)
+            i += 1
+        else:
+            out.append(y)
+            j += 1
+    out.extend(a[i:])
+    out.extend(b[j:])
+    return out
 
-def evaluar_rpn(rpn, buscar_fn, universo: set):
-    pila = []
+
+def _not(universo: Sequence[int], a: Sequence[int]) -> List[int]:
+    """Complemento de `a` respecto de `universo` (ambas listas ordenadas)."""
+    out: List[int] = []
+    j = 0
+    na = len(a)
+    for d in universo:
+        while j < na and a[j] < d:
+            j += 1
+        if j < na and a[j] == d:
+            j += 1
+        else:
+            out.append(d)
+    return out
+
+
+# Códigos de operación del programa compilado
+_OP_TERM, _OP_NOT, _OP_AND, _OP_OR = range(4)
+
+
+def _rpn_a_programa(rpn):
+    """Convierte la RPN en un programa plano en postorden.
+
+    Devuelve (ops, args): para el nodo i, ops[i] es un código _OP_* y
+    args[i] es el término (TERM), el índice del operando (NOT) o el par de
+    índices de los operandos (AND/OR). Los operandos siempre tienen índice
+    menor que el operador y la raíz es el último nodo. Se construye con una
+    pila explícita, sin recursión, así que la profundidad de la consulta no
+    está limitada por la pila de Python.
+    """
+    ops: List[int] = []
+    args: list = []
+    pila: List[int] = []
     for t in rpn:
         if isinstance(t, tuple) and t and t[0] == "TERM":
-            term = t[1]
-            pila.append(set(buscar_fn(term)))
+            ops.append(_OP_TERM)
+            args.append(t[1])
         elif t == "NOT":
             if not pila:
                 raise ValueError("Operador NOT sin operando")
-            a = pila.pop()
-            pila.append(universo - a)
+            ops.append(_OP_NOT)
+            args.append(pila.pop())
         elif t in ("AND", "OR"):
             if len(pila) < 2:
                 raise ValueError(f"Operador {t} con operandos insuficientes")
             b = pila.pop()
             a = pila.pop()
-            pila.append(a & b if t == "AND" else a | b)
+            ops.append(_OP_AND if t == "AND" else _OP_OR)
+            args.append((a, b))
         else:
             raise ValueError(f"Token desconocido en RPN: {t}")
+        pila.append(len(ops) - 1)
     if len(pila) != 1:
         raise ValueError("Expresión inválida")
-    return pila[0]
+    return tuple(ops), tuple(args)
+
+
+# Anidamiento máximo de una consulta compilada. Las cadenas de un mismo
+# operador (a AND b AND c ...) y de NOT se aplanan al compilar, así que
+# sólo cuentan los niveles que alternan operadores; el límite mantiene la
+# evaluación lejos del límite de recursión de Python.
+_MAX_ANIDAMIENTO = 200
+
+
+def _hoja(term):
+    def f(buscar_fn, universo, ordenes):
+        return buscar_fn(term)
+
+    return f
+
+
+def _negacion(x, impar: bool):
+    # NOT NOT x == x ∩ universo: una cadena de NOT se reduce a su paridad
+    if impar:
+
+        def f(buscar_fn, universo, ordenes):
+            return _not(universo, x(buscar_fn, universo, ordenes))
+
+    else:
+
+        def f(buscar_fn, universo, ordenes):
+            return _and(universo, x(buscar_fn, universo, ordenes))
+
+    return f
+
+
+def _union(primero, resto):
+    def f(buscar_fn, universo, ordenes):
+        res = primero(buscar_fn, universo, ordenes)
+        for h in resto:
+            res = _or(res, h(buscar_fn, universo, ordenes))
+        return res
+
+    return f
+
+
+def _interseccion(slot: int):
+    # El orden de los operandos se lee de `ordenes`, que arma la
+    # planificación por costo; si el resultado parcial queda vacío, el
+    # resto de los operandos no se evalúa.
+    def f(buscar_fn, universo, ordenes):
+        primero, resto = ordenes[slot]
+        res = primero(buscar_fn, universo, ordenes)
+        for h in resto:
+            if not res:
+                break
+            res = _and(res, h(buscar_fn, universo, ordenes))
+        return res
+
+    return f
+
+
+class _ConsultaCompilada:
+    """Consulta booleana compilada a closures que llaman a _and/_or/_not.
+
+    Evaluarla no compara tokens ni despacha por código de operación: cada
+    nodo es una función que llama directamente a las de sus operandos. Las
+    cadenas de AND y de OR se aplanan en un único nodo n-ario y las de NOT
+    se reducen a su paridad.
+
+    El orden de los operandos de cada AND (de menor a mayor costo según
+    `costo_fn`) se calcula una sola vez y se guarda junto con el último
+    `costo_fn` y tamaño de universo usados: mientras no cambien, repetir la
+    consulta no vuelve a llamar a `costo_fn`.
+    """
+
+    def __init__(self, rpn: tuple):
+        ops, args = _rpn_a_programa(rpn)
+        n = len(ops)
+        # Operandos aplanados (AND/OR) o nodo negado (NOT), por nodo
+        hijos: list = [None] * n
+        negaciones = [0] * n
+        anidamiento = [1] * n
+        for i, op in enumerate(ops):
+            if op == _OP_NOT:
+                x = args[i]
+                if ops[x] == _OP_NOT:
+                    hijos[i] = hijos[x]
+                    negaciones[i] = negaciones[x] + 1
+                    anidamiento[i] = anidamiento[x]
+                else:
+                    hijos[i] = x
+                    negaciones[i] = 1
+                    anidamiento[i] = anidamiento[x] + 1
+            elif op != _OP_TERM:
+                a, b = args[i]
+                # El operando izquierdo absorbido ya no se usa: su lista se
+                # reutiliza y una cadena a izquierda se aplana en O(n).
+                lista = hijos[a] if ops[a] == op else [a]
+                lista.extend(hijos[b] if ops[b] == op else (b,))
+                hijos[i] = lista
+                anidamiento[i] = max(
+                    anidamiento[x] if ops[x] == op else anidamiento[x] + 1
+                    for x in args[i]
+                )
+        if anidamiento[-1] > _MAX_ANIDAMIENTO:
+            raise ValueError("Consulta demasiado anidada")
+
+        # Nodos que quedan tras aplanar, en postorden (operandos primero)
+        vivos: List[int] = []
+        pila = [n - 1]
+        while pila:
+            i = pila.pop()
+            vivos.append(i)
+            if ops[i] == _OP_NOT:
+                pila.append(hijos[i])
+            elif ops[i] != _OP_TERM:
+                pila.extend(hijos[i])
+        vivos.sort()
+
+        funcs: Dict[int, object] = {}
+        slots: Dict[int, int] = {}
+        ordenes_rpn: list = []
+        for i in vivos:
+            op = ops[i]
+            if op == _OP_TERM:
+                funcs[i] = _hoja(args[i])
+            elif op == _OP_NOT:
+                funcs[i] = _negacion(funcs[hijos[i]], negaciones[i] % 2 == 1)
+            else:
+                operandos = [funcs[x] for x in hijos[i]]
+                if op == _OP_OR:
+                    funcs[i] = _union(operandos[0], tuple(operandos[1:]))
+                else:
+                    slots[i] = len(ordenes_rpn)
+                    ordenes_rpn.append((operandos[0], tuple(operandos[1:])))
+                    funcs[i] = _interseccion(slots[i])
+
+        self._ops = ops
+        self._args = args
+        self._hijos = hijos
+        self._negaciones = negaciones
+        self._vivos = vivos
+        self._funcs = funcs
+        self._slots = slots
+        self._raiz = funcs[n - 1]
+        # Sin costo_fn, los operandos de AND se evalúan en el orden de la RPN
+        self._ordenes_rpn = tuple(ordenes_rpn)
+        self._clave = None
+        self._ordenes = self._ordenes_rpn
+
+    def _planificar(self, costo_fn, n_universo: int) -> tuple:
+        """Ordena los operandos de cada AND por costo, en una pasada.
+
+        Los nodos se recorren en postorden, así que el costo de cada
+        operador se arma con los de sus operandos: costo_fn se llama a lo
+        sumo una vez por término distinto.
+        """
+        ops, hijos = self._ops, self._hijos
+        ordenes = list(self._ordenes_rpn)
+        costos: Dict[int, int] = {}
+        por_termino: Dict[str, int] = {}
+        for i in self._vivos:
+            op = ops[i]
+            if op == _OP_TERM:
+                term = self._args[i]
+                if term not in por_termino:
+                    por_termino[term] = costo_fn(term)
+                costos[i] = por_termino[term]
+            elif op == _OP_NOT:
+                if self._negaciones[i] % 2 == 1:
+                    costos[i] = n_universo
+                else:
+                    costos[i] = costos[hijos[i]]
+            elif op == _OP_OR:
+                costos[i] = sum(costos[x] for x in hijos[i])
+            else:
+                orden = sorted(hijos[i], key=costos.__getitem__)
+                costos[i] = costos[orden[0]]
+                ordenes[self._slots[i]] = (
+                    self._funcs[orden[0]],
+                    tuple(self._funcs[x] for x in orden[1:]),
+                )
+        return tuple(ordenes)
 
+    def __call__(self, buscar_fn, universo: Sequence[int], costo_fn=None):
+        if costo_fn is None or not self._slots:
+            ordenes = self._ordenes_rpn
+        else:
+            clave = (costo_fn, len(universo))
+            if clave != self._clave:
+                self._ordenes = self._planificar(costo_fn, len(universo))
+                self._clave = clave
+            ordenes = self._ordenes
+        return self._raiz(buscar_fn, universo, ordenes)
+
+
+@lru_cache(maxsize=256)
+def _compilar(rpn: tuple) -> _ConsultaCompilada:
+    return _ConsultaCompilada(rpn)
+
+
+def compilar_rpn(rpn):
+    """Compila una consulta en RPN a una función reutilizable.
+
+    Devuelve f(buscar_fn, universo, costo_fn) que evalúa la consulta. Las
+    consultas compiladas se cachean por `tuple(rpn)`: repetir una consulta
+    no vuelve a recorrer ni validar la RPN, ni a armar las closures, y
+    mientras `costo_fn` y el tamaño del universo no cambien tampoco se
+    vuelve a planificar el orden de los AND.
+    """
+    return _compilar(tuple(rpn))
+
+
+def evaluar_rpn(rpn, buscar_fn, universo: Sequence[int], costo_fn=None):
+    """Evalúa una consulta en RPN y devuelve los docIDs ordenados.
+
+    En cada AND se evalúa primero el operando de menor costo estimado
+    (`costo_fn(term)`, p. ej. `CompressedReader.postings_size`) y, apenas
+    el resultado parcial queda vacío, los demás operandos no se evalúan ni
+    se decodifican.
+    """
+    return compilar_rpn(rpn)(buscar_fn, universo, costo_fn)
+
+
+def busqueda_and(buscar_fn, terminos, costo_fn=None) -> List[int]:
+    """AND de varios términos, empezando por el de menor costo estimado.
+
+    Apenas la intersección parcial queda vacía se deja de decodificar el
+    resto de los términos.
+    """
+    terminos = [term for term in terminos if term]
+    if costo_fn is not None:
+        terminos.sort(key=costo_fn)
+    if not terminos:
+        return []
+    resultado = buscar_fn(terminos[0])
+    for term in terminos[1:]:
+        if not resultado:
+            break
+        resultado = _and(resultado, buscar_fn(term))
+    return resultado
 
-def busqueda_and(buscar_fn, terminos):
-    sets = [set(buscar_fn(term)) for term in terminos if term]
-    return set.intersection(*sets) if sets else set()
 
+def busqueda_or(buscar_fn, terminos) -> List[int]:
+    listas = [buscar_fn(term) for term in terminos if term]
+    return reduce(_or, listas) if listas else []
 
-def busqueda_or(buscar_fn, terminos):
-    sets = [set(buscar_fn(term)) for term in terminos if term]
-    return set.union(*sets) if sets else set()
 
+def busqueda_not(buscar_fn, terminos, universo: Sequence[int]) -> List[int]:
+    excluidos = busqueda_or(buscar_fn, terminos)
+    return _not(universo, excluidos)
 
-def busqueda_not(buscar_fn, terminos, universo: set):
-    sets = [set(buscar_fn(term)) for term in terminos if term]
-    excluidos = set.union(*sets) if sets else set()
-    return universo - excluidos
 
+def ids_a_nombres(doc_ids: Sequence[int], doc_name_fn) -> List[str]:
+    """Convierte doc_ids (ordenados) a nombres de documentos.
 
-def ids_a_nombres(doc_ids: set, doc_name_fn) -> List[str]:
-    """Convierte un conjunto de doc_ids a nombres de documentos."""
-    nombres = []
-    for doc_id in doc_ids:
-        if callable(doc_name_fn):
-            nombres.append(doc_name_fn(doc_id))
-        else:
-            nombres.append(str(doc_id))
-    return sorted(nombres)
+    Los resultados de búsqueda ya vienen ordenados por docID, así que se
+    convierten en ese orden sin reordenar los nombres. Para doc_ids
+    originalmente strings el orden coincide con el alfabético, porque
+    `comprimir._normalize_docids_to_ints` asigna los enteros en ese orden.
+    """
+    return [doc_name_fn(i) for i in doc_ids]
 
 
 def main():
@@ -293,8 +783,12 @@ def main():
     try:
         cr = CompressedReader(base_dir)
         buscar_fn = cr.postings
+        costo_fn = cr.postings_size
         doc_name_fn = cr.get_doc_name
-        universo = _universo_docs_from_backend(buscar_fn)
+        # Los docIDs son enteros asignados por _normalize_docids_to_ints a
+        # cada documento distinto: el universo sale del mapeo, sin decodificar
+        # ninguna lista de postings.
+        universo = sorted(cr.doc_id_map.values())
         if not universo:
             back_desc = "Índice comprimido (NOT limitado)"
         else:
@@ -318,14 +812,14 @@ def main():
         if opcion == "0":
             palabra = obtener_palabra_simple()
             if palabra:
-                resultado = set(buscar_fn(palabra))
+                resultado = buscar_fn(palabra)
                 nombres = ids_a_nombres(resultado, doc_name_fn)
                 print(f"\nDocumentos que contienen '{palabra}':", nombres)
             else:
                 print("Debe ingresar una palabra.")
         elif opcion == "1":
             terminos = obtener_consulta()
-            resultado = busqueda_and(buscar_fn, terminos)
+            resultado = busqueda_and(buscar_fn, terminos, costo_fn)
             nombres = ids_a_nombres(resultado, doc_name_fn)
             print("\nDocumentos encontrados:", nombres)
         elif opcion == "2":
@@ -350,13 +844,14 @@ def main():
                 rpn = _a_rpn(tokens)
                 if not universo and "NOT" in tokens:
                     raise ValueError("NOT no disponible con este backend")
-                resultado = evaluar_rpn(rpn, buscar_fn, universo)
+                resultado = evaluar_rpn(rpn, buscar_fn, universo, costo_fn)
                 nombres = ids_a_nombres(resultado, doc_name_fn)
                 print("Documentos encontrados:", nombres)
             except ValueError as e:
                 print(f"Error en la consulta: {e}")
         elif opcion == "5":
             print("Saliendo...")
+            cr.close()
             break
         else:
             print("Opción inválida. Intente de nuevo.")
@@ -8,7 +8,7 @@ Este módulo está pensado para funcionar con el índice producido por indexar.p
 Notas (alineado al apunte teórico):
 - Diccionario: front coding bloqueado. En cada bloque se guarda el primer
   término completo y para los siguientes se guarda la longitud del prefijo
-  común con el primero del bloque (LCP) y el sufijo restante.
+  común con el primero del bloque (LCP, en bytes UTF-8) y el sufijo restante.
 - Postings: se comprimen en un blob único aplicando d-gaps y luego
   codificación Variable-Byte por cada gap.
 
@@ -17,8 +17,10 @@ Estructura de retorno de `comprimir_indice`:
   'lexicon_bytes': bytes,               # diccionario comprimido
   'lexicon_block_size': int,            # tamaño de bloque usado para FC
   'lexicon_terms_order': list[str],     # términos en orden (para referencia)
+  'lexicon_block_offsets': list[int],   # offset de cada bloque en el lexicón
   'postings_bytes': bytes,              # blob con todas las postings VB
   'postings_offsets': dict[str, (int,int)],  # term -> (offset, length)
+  'postings_offsets_bytes': bytes,      # tabla binaria de offsets por term-id
   'doc_id_map': dict[str,int],          # mapeo doc_id original -> entero
   'rev_doc_id_map': list[str],          # índice a doc_id original
 }
@@ -29,8 +31,13 @@ front coding.
 
 from __future__ import annotations
 
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from typing import Dict, List, Tuple, Iterable
+from itertools import islice
+from operator import lt, sub
+from typing import AnyStr, Dict, List, Optional, Tuple, Iterable
 
 
 # =============== Variable-Byte (VB) encoding ===============
@@ -61,11 +68,45 @@ def vb_encode_number(n: int) -> bytes:
     return bytes(out)
 
 
+def _vb_write_inline(out: bytearray, n: int) -> None:
+    """Agrega VB(n) directamente al final de `out`.
+
+    Equivalente a `out.extend(vb_encode_number(n))` pero sin crear la lista de
+    chunks ni el objeto bytes intermedio: la cantidad de bytes se calcula a
+    partir de `n.bit_length()` y se escriben de mayor a menor peso.
+    """
+    if n < 0:
+        raise ValueError("VB requiere enteros no negativos")
+    shift = 7 * (((n.bit_length() + 6) // 7 or 1) - 1)
+    while shift:
+        out.append((n >> shift) & 0x7F)
+        shift -= 7
+    out.append((n & 0x7F) | 0x80)  # último byte con MSB=1
+
+
 def vb_encode_list(nums: Iterable[int]) -> bytes:
     """Codifica una lista de enteros no negativos con VB concatenados."""
     out = bytearray()
     for n in nums:
-        out.extend(vb_encode_number(n))
+        _vb_write_inline(out, n)
+    return bytes(out)
+
+
+def _vb_write_dgaps(out: bytearray, sorted_docids: List[int]) -> None:
+    """Agrega a `out` los d-gaps de una posting codificados con VB.
+
+    d-gaps y VB en una sola pasada, sin listas intermedias.
+    """
+    acc = 0
+    for d in sorted_docids:
+        _vb_write_inline(out, d - acc)
+        acc = d
+
+
+def _encode_postings(sorted_docids: List[int]) -> bytes:
+    """VB + d-gaps de una posting aislada (unidad de trabajo en paralelo)."""
+    out = bytearray()
+    _vb_write_dgaps(out, sorted_docids)
     return bytes(out)
 
 
@@ -73,17 +114,18 @@ def d_gaps(sorted_docids: List[int]) -> List[int]:
     """Convierte una lista ordenada de docIDs a d-gaps: [d1, d2-d1, ...]."""
     if not sorted_docids:
         return []
+    # map + operator.sub resta los pares consecutivos en C, sin indexar ni
+    # hacer append desde Python en cada iteración
     gaps = [sorted_docids[0]]
-    for i in range(1, len(sorted_docids)):
-        gaps.append(sorted_docids[i] - sorted_docids[i - 1])
+    gaps.extend(map(sub, islice(sorted_docids, 1, None), sorted_docids))
     return gaps
 
 
 # =============== Front coding (bloques) ===============
 
 
-def lcp(a: str, b: str) -> int:
-    """Longest Common Prefix length entre a y b."""
+def lcp(a: AnyStr, b: AnyStr) -> int:
+    """Longest Common Prefix length entre a y b (str o bytes)."""
     i = 0
     m = min(len(a), len(b))
     while i < m and a[i] == b[i]:
@@ -91,38 +133,71 @@ def lcp(a: str, b: str) -> int:
     return i
 
 
-def front_code_blocks(terms_sorted: List[str], block_size: int = 8) -> bytes:
+def front_code_blocks(
+    terms_sorted: List[str],
+    block_size: int = 8,
+    block_offsets: Optional[List[int]] = None,
+) -> bytes:
     """Serializa el diccionario aplicando front coding por bloques.
 
     Formato por bloque (bytes):
     - VB(len(base)), base.encode('utf-8')
     - VB(k-1)  donde k es el tamaño del bloque real (<= block_size)
     - Por cada término adicional t en el bloque:
-      VB(lcp(base, t)), VB(len(sufijo)), sufijo.encode('utf-8')
+      VB(p), VB(len(sufijo)), sufijo
+      donde p es el LCP en bytes UTF-8 entre base y t (ajustado a un límite
+      de carácter) y sufijo = t.encode('utf-8')[p:]
 
     Devolvemos un único blob de bytes con la concatenación de todos los
-    bloques.
+    bloques. Si se pasa `block_offsets`, se le agrega el offset en el blob
+    donde empieza cada bloque, para poder decodificar un bloque aislado.
     """
     out = bytearray()
     n = len(terms_sorted)
     i = 0
     while i < n:
-        block = terms_sorted[i : i + block_size]
-        base = block[0]
-        base_b = base.encode("utf-8")
-        out.extend(vb_encode_number(len(base_b)))
+        if block_offsets is not None:
+            block_offsets.append(len(out))
+        # Cada término se codifica una sola vez y el LCP se calcula en bytes
+        block_b = [t.encode("utf-8") for t in terms_sorted[i : i + block_size]]
+        base_b = block_b[0]
+        _vb_write_inline(out, len(base_b))
         out.extend(base_b)
 
-        followers = block[1:]
-        out.extend(vb_encode_number(len(followers)))
-        for t in followers:
-            p = lcp(base, t)
-            suf = t[p:]
-            suf_b = suf.encode("utf-8")
-            out.extend(vb_encode_number(p))
-            out.extend(vb_encode_number(len(suf_b)))
-            out.extend(suf_b)
-        i += len(block)
+        _vb_write_inline(out, len(block_b) - 1)
+        for tb in block_b[1:]:
+            p = lcp(base_b, tb)
+            # No cortar un carácter multi-byte: retroceder mientras el byte
+            # siguiente sea de continuación UTF-8 (10xxxxxx)
+            while p and p < len(tb) and tb[p] & 0xC0 == 0x80:
+                p -= 1
+            _vb_write_inline(out, p)
+            _vb_write_inline(out, len(tb) - p)
+            out.extend(memoryview(tb)[p:])
+        i += len(block_b)
+    return bytes(out)
+
+
+# =============== Tabla binaria de offsets ===============
+
+# Registro por término: offset (uint64) y longitud (uint32) en el blob de
+# postings, little-endian y sin padding. El registro i corresponde al i-ésimo
+# término del diccionario ordenado (term-id).
+OFFSET_RECORD = struct.Struct("<QI")
+
+
+def serializar_offsets(
+    postings_offsets: Dict[str, Tuple[int, int]], terms_sorted: List[str]
+) -> bytes:
+    """Empaqueta los offsets de postings como un arreglo de registros fijos.
+
+    A diferencia de un JSON {término: (offset, longitud)}, el resultado puede
+    mapearse en memoria y accederse por term-id sin parsear nada.
+    """
+    out = bytearray(OFFSET_RECORD.size * len(terms_sorted))
+    for i, term in enumerate(terms_sorted):
+        start, length = postings_offsets[term]
+        OFFSET_RECORD.pack_into(out, i * OFFSET_RECORD.size, start, length)
     return bytes(out)
 
 
@@ -134,8 +209,10 @@ class CompressedIndex:
     lexicon_bytes: bytes
     lexicon_block_size: int
     lexicon_terms_order: List[str]
+    lexicon_block_offsets: List[int]
     postings_bytes: bytes
     postings_offsets: Dict[str, Tuple[int, int]]
+    postings_offsets_bytes: bytes
     doc_id_map: Dict[str, int]
     rev_doc_id_map: List[str]
 
@@ -145,7 +222,8 @@ def _normalize_docids_to_ints(
 ) -> Tuple[Dict[str, List[int]], Dict[str, int], List[str]]:
     """Normaliza los doc_ids (posibles strings) a enteros consecutivos.
 
-    - Si ya son ints, simplemente se asegura de ordenarlos en cada posting.
+    - Si ya son ints, simplemente se asegura de ordenarlos en cada posting
+      (sólo se ordena si la posting no viene ya ordenada y sin repetidos).
     - Si son strings, mapea cada doc_id distinto a un entero estable
       determinado por el orden lexicográfico del doc_id original.
 
@@ -189,14 +267,21 @@ def _normalize_docids_to_ints(
 
     index_int: Dict[str, List[int]] = {}
     for term, plist in index.items():
-        ints = sorted({to_int(d) for d in plist})
+        ints = [to_int(d) for d in plist]
+        # BSBI ya entrega postings ordenadas y sin repetidos, y el mapeo de
+        # strings a enteros preserva el orden lexicográfico: en ese caso basta
+        # con verificarlo en O(n) en lugar de ordenar y deduplicar.
+        if not all(map(lt, ints, islice(ints, 1, None))):
+            ints = sorted(set(ints))
         index_int[term] = ints
 
     return index_int, doc_id_map, rev
 
 
 def comprimir_indice(
-    index: Dict[str, List[object]], block_size: int = 8
+    index: Dict[str, List[object]],
+    block_size: int = 8,
+    workers: Optional[int] = 1,
 ) -> CompressedIndex:
     """Comprime un índice invertido (término -> [doc_ids]) con:
     - Front Coding bloqueado para el diccionario de términos
@@ -205,6 +290,10 @@ def comprimir_indice(
     Args:
         index: diccionario {término: lista de doc_ids (str o int)}
         block_size: tamaño de bloque para front coding.
+        workers: procesos para codificar las postings en paralelo. Con 1
+            (por defecto) se codifica en el proceso actual; con None se usa
+            os.cpu_count(). Sólo conviene en índices grandes: para corpus
+            chicos el costo de lanzar procesos supera la ganancia.
 
     Returns:
         CompressedIndex con los blobs y metadatos necesarios.
@@ -218,24 +307,39 @@ def comprimir_indice(
     # Ordenamos términos para estabilidad y para el diccionario
     terms_sorted = sorted(index_int.keys())
 
-    for term in terms_sorted:
-        plist = index_int[term]
-        gaps = d_gaps(plist)
-        encoded = vb_encode_list(gaps)
-        start = len(postings_blob)
-        postings_blob.extend(encoded)
-        end = len(postings_blob)
-        postings_offsets[term] = (start, end - start)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1:
+        # Cada posting se codifica de forma independiente: se reparten entre
+        # procesos (la codificación VB en Python no libera el GIL) y luego se
+        # concatenan en orden recalculando los offsets.
+        plists = [index_int[term] for term in terms_sorted]
+        chunksize = max(1, len(plists) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            encoded = ex.map(_encode_postings, plists, chunksize=chunksize)
+            for term, enc in zip(terms_sorted, encoded):
+                postings_offsets[term] = (len(postings_blob), len(enc))
+                postings_blob.extend(enc)
+    else:
+        for term in terms_sorted:
+            start = len(postings_blob)
+            _vb_write_dgaps(postings_blob, index_int[term])
+            postings_offsets[term] = (start, len(postings_blob) - start)
 
     # 3) Front coding para el diccionario
-    lexicon_bytes = front_code_blocks(terms_sorted, block_size=block_size)
+    lexicon_block_offsets: List[int] = []
+    lexicon_bytes = front_code_blocks(
+        terms_sorted, block_size=block_size, block_offsets=lexicon_block_offsets
+    )
 
     return CompressedIndex(
         lexicon_bytes=bytes(lexicon_bytes),
         lexicon_block_size=block_size,
         lexicon_terms_order=terms_sorted,
+        lexicon_block_offsets=lexicon_block_offsets,
         postings_bytes=bytes(postings_blob),
         postings_offsets=postings_offsets,
+        postings_offsets_bytes=serializar_offsets(postings_offsets, terms_sorted),
         doc_id_map=doc_id_map,
         rev_doc_id_map=rev_doc_id_map,
     )
@@ -1,5 +1,6 @@
 from pathlib import Path
 import json
+import os
 
 
 def sizeof_uncompressed(index: dict[str, list]) -> tuple[int, int, int]:
@@ -28,29 +29,37 @@ def contar_tokens(corpus_path: Path, bsbi) -> int:
     return total
 
 
+def _reemplazar_archivo(path: Path, data: bytes) -> None:
+    # Se escribe a un temporal y se reemplaza: un lector que tenga mapeado
+    # el archivo anterior sigue viendo su contenido, en lugar de encontrarlo
+    # truncado.
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
 def guardar_comprimido(base_dir: Path, comp) -> None:
     idx_dir = base_dir / "index"
     idx_dir.mkdir(exist_ok=True)
 
     # Guardar blobs binarios
-    (idx_dir / "postings.bin").write_bytes(comp.postings_bytes)
-    (idx_dir / "lexicon.bin").write_bytes(comp.lexicon_bytes)
+    _reemplazar_archivo(idx_dir / "postings.bin", comp.postings_bytes)
+    _reemplazar_archivo(idx_dir / "lexicon.bin", comp.lexicon_bytes)
+    _reemplazar_archivo(
+        idx_dir / "postings_offsets.bin", comp.postings_offsets_bytes
+    )
 
     # Guardar metadatos JSON
-    with open(idx_dir / "postings_offsets.json", "w", encoding="utf-8") as f:
-        json.dump(comp.postings_offsets, f, ensure_ascii=False)
-
-    with open(idx_dir / "doc_maps.json", "w", encoding="utf-8") as f:
-        json.dump(
-            {
-                "doc_id_map": comp.doc_id_map,
-                "rev_doc_id_map": comp.rev_doc_id_map,
-                "terms_order": comp.lexicon_terms_order,
-                "block_size": comp.lexicon_block_size,
-            },
-            f,
-            ensure_ascii=False,
-        )
+    maps = json.dumps(
+        {
+            "doc_id_map": comp.doc_id_map,
+            "rev_doc_id_map": comp.rev_doc_id_map,
+            "block_size": comp.lexicon_block_size,
+            "lexicon_block_offsets": comp.lexicon_block_offsets,
+        },
+        ensure_ascii=False,
+    )
+    _reemplazar_archivo(idx_dir / "doc_maps.json", maps.encode("utf-8"))
 
 
 def main() -> None:
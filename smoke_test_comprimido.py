@@ -1,5 +1,33 @@
 from pathlib import Path
 import importlib
+import tempfile
+
+
+def verificar_lectura_desde_disco(indice, block_size: int) -> int:
+    """Guarda el índice comprimido en disco y lo relee con CompressedReader.
+
+    Compara las postings de todos los términos contra el índice BSBI, así
+    que cubre el formato completo: postings_offsets.bin, el lexicón
+    front-coded (LCP en bytes UTF-8) y los term-ids por bloque.
+    """
+    comprimir = importlib.import_module("comprimir")
+    main = importlib.import_module("main")
+    buscar = importlib.import_module("buscar")
+
+    comp = comprimir.comprimir_indice(indice, block_size=block_size)
+    with tempfile.TemporaryDirectory() as tmp:
+        base = Path(tmp)
+        main.guardar_comprimido(base, comp)
+        # El lector se cierra antes de borrar el directorio temporal: en
+        # Windows no se puede eliminar un archivo mapeado en memoria.
+        with buscar.CompressedReader(base) as reader:
+            for t, docs in indice.items():
+                leidos = [reader.rev_doc_id_map[i] for i in reader.postings(t)]
+                assert (
+                    leidos == docs
+                ), f"Postings difieren para '{t}': {docs} vs {leidos}"
+            assert reader.postings("término-inexistente") == ()
+    return len(indice)
 
 
 def run():
@@ -17,6 +45,10 @@ def run():
     # Comprimir
     comp = comprimir.comprimir_indice(indice, block_size=8)
 
+    # La codificación en paralelo debe producir exactamente el mismo índice
+    comp_paralelo = comprimir.comprimir_indice(indice, block_size=8, workers=2)
+    assert comp_paralelo == comp, "La compresión con workers=2 difiere"
+
     # Persistir temporalmente en memoria (sin escribir disco)
     # Crear un lector comprimido sin archivos no es trivial;
     # verificamos consistencia de postings desde offsets en memoria.
@@ -72,6 +104,20 @@ def run():
 
     print("Smoke test OK: postings coinciden para 3 términos.")
 
+    # Lectura desde disco de todos los términos, agregando algunos no ASCII
+    # que comparten prefijos multi-byte, con bloques de distinto tamaño
+    indice_disco = dict(indice)
+    doc = next(iter(indice.values()))[:1]
+    for t in ["ácido", "ácidó", "áé", "áéz", "aé", "ñu", "ñañá", "€x", "€€", "𝔸b"]:
+        indice_disco[t] = doc
+    for block_size in (8, 3):
+        n = verificar_lectura_desde_disco(indice_disco, block_size)
+        print(
+            f"Smoke test OK: {n} términos leídos desde disco "
+            f"(block_size={block_size})."
+        )
+    print("Smoke test OK: compresión con workers=2 idéntica a la secuencial.")
+
 
 if __name__ == "__main__":
     run()